@@ -5,12 +5,89 @@ import os
 import sys
 import json
 import base64
+import queue
+import logging
+import logging.handlers
 from pathlib import Path
 import tkinter as tk
 from tkinter import messagebox, filedialog, Button, Label
 from tkinter import ttk
 from tkinter import simpledialog
 
+LOG_DRAIN_MS = 100  # How often queued log records are moved into the console
+LOG_BATCH = 1000  # Most records moved per drain, so one drain never blocks the event loop for long
+MAX_LOG_LINES = 5000  # The console only keeps this many of the most recent lines
+LOG_FILE = Path('batch_zipper.log')
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+logger = logging.getLogger('batch_zipper')
+log_queue = queue.Queue()
+
+def setup_logging(level=logging.INFO):
+    """
+    Route GUI and zipper log records into the queue drained by the console.
+    Args:
+        level (int): Lowest level shown in the console.
+    Returns:
+        logging.Handler: The queue handler, whose level can be changed later.
+    """
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt='%H:%M:%S'))
+    handler.setLevel(level)
+    for name in ('batch_zipper', 'zipper'):
+        named = logging.getLogger(name)
+        named.setLevel(logging.DEBUG)
+        named.addHandler(handler)
+    if sys.stdout is not None:  # No console in the windowed build
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(logging.Formatter('%(message)s'))
+        stream.setLevel(logging.INFO)
+        for name in ('batch_zipper', 'zipper'):
+            logging.getLogger(name).addHandler(stream)
+    return handler
+
+def set_log_file(enabled, level=logging.INFO, path=LOG_FILE):
+    """
+    Start or stop writing GUI and zipper log records to a file.
+    Args:
+        enabled (bool): Whether to log to the file.
+        level (int): Lowest level written to the file.
+        path (Path): Log file location.
+    """
+    for name in ('batch_zipper', 'zipper'):
+        named = logging.getLogger(name)
+        for handler in [h for h in named.handlers if isinstance(h, logging.FileHandler)]:
+            named.removeHandler(handler)
+            handler.close()
+    if enabled:
+        handler = logging.FileHandler(path, encoding='utf-8')
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handler.setLevel(level)
+        for name in ('batch_zipper', 'zipper'):
+            logging.getLogger(name).addHandler(handler)
+
+def drain_log(console_log):
+    """
+    Move queued log records into the console in one batch, trimming it to MAX_LOG_LINES.
+    Reschedules itself every LOG_DRAIN_MS.
+    Args:
+        console_log (tk.Text): Console widget.
+    """
+    lines = []
+    try:
+        while len(lines) < LOG_BATCH:
+            lines.append(log_queue.get_nowait().getMessage())
+    except queue.Empty:
+        pass
+    if lines:
+        console_log.insert('end', '\n'.join(lines) + '\n')
+        excess = int(console_log.index('end-1c').split('.')[0]) - 1 - MAX_LOG_LINES
+        if excess > 0:
+            console_log.delete('1.0', f'{excess + 1}.0')
+        console_log.see('end')
+    console_log.after(LOG_DRAIN_MS, drain_log, console_log)
+
 def decode_password(b64):
     salt = "_Bz9!"
     try:
@@ -84,7 +161,7 @@ def ensure_config(config_path):
             return None
     
     decoded_paths = [p for p in [decode_path(p) for p in encoded_paths] if p is not None]
-    print('DEBUG ensure_config returns:', decoded_paths, encoded_pw)
+    logger.debug(f"ensure_config returns: {decoded_paths} {encoded_pw}")
     return decoded_paths, encoded_pw
 
 def save_config(config_path, paths):
@@ -96,51 +173,41 @@ def save_config(config_path, paths):
     Author: Kelvin
     """
     import base64
+    tuning = {}
     if config_path.exists():
         with open(config_path, 'r') as f:
             config_obj = json.load(f)
         encoded_pw = config_obj.get("meta", {}).get("pw", encode_password("default"))
+        tuning = config_obj.get("tuning", {})
     else:
         encoded_pw = encode_password("default")
     encoded = [base64.b64encode(p.encode('utf-8')).decode('utf-8') for p in paths if isinstance(p, str)]
     config_obj = {"meta": {"pw": encoded_pw}, "paths": encoded}
+    if tuning:
+        config_obj["tuning"] = tuning
     with open(config_path, 'w') as f:
         json.dump(config_obj, f, indent=2)
 
-def zipper_operation(folder, op, progress_callback=None):
+def zipper_operation(folder, op, progress_callback=None, autotune=False):
     """
     Perform zip or unzip operation on a folder.
     Args:
         folder (str): Path to the folder.
         op (str): Operation type ('zip' or 'unzip').
         progress_callback (callable): Function to call with progress updates.
+        autotune (bool, optional): Tune worker count and chunk size while zipping.
     Author: Kelvin
     """
     from zipper import zip_folder, unzip_folder
-    import builtins
-    import threading
     
-    if hasattr(builtins, '_console_log'):
-        _print = builtins.print
-        def log_print(*args, **kwargs):
-            msg = ' '.join(str(a) for a in args)
-            builtins._console_log.after(0, lambda: builtins._console_log.insert('end', msg + '\n'))
-            builtins._console_log.after(0, lambda: builtins._console_log.see('end'))
-            _print(*args, **kwargs)
-        builtins.print = log_print
-    
-    try:
-        if op == 'zip':
-            zip_folder(folder, progress_callback)
-        elif op == 'unzip':
-            unzip_folder(folder, progress_callback)
-        else:
-            messagebox.showerror("Error", f"Unknown operation: {op}")
-    finally:
-        if hasattr(builtins, '_console_log'):
-            builtins.print = _print
+    if op == 'zip':
+        zip_folder(folder, progress_callback, autotune=autotune)
+    elif op == 'unzip':
+        unzip_folder(folder, progress_callback)
+    else:
+        messagebox.showerror("Error", f"Unknown operation: {op}")
 
-def run_selected(op, paths, listbox, progress_bar=None, power_user=False):
+def run_selected(op, paths, listbox, progress_bar=None, power_user=False, autotune=False):
     """
     Run the selected zip/unzip operation for all or selected paths in a separate thread.
     Args:
@@ -149,12 +216,12 @@ def run_selected(op, paths, listbox, progress_bar=None, power_user=False):
         listbox (Listbox or None): Tkinter Listbox widget or None for all paths.
         progress_bar (ttk.Progressbar, optional): Progress bar widget.
         power_user (bool, optional): Whether power user mode is enabled.
+        autotune (bool, optional): Tune worker count and chunk size while zipping.
     Author: Kelvin
     """
     import threading
     import queue
     import tkinter as tk
-    import builtins
     import time
     
     progress_queue = queue.Queue()
@@ -216,25 +283,23 @@ def run_selected(op, paths, listbox, progress_bar=None, power_user=False):
                 if op == 'zip':
                     total_files += sum(1 for _ in Path(folder).rglob('*') if _.is_file() and not str(_).lower().endswith('.json'))
                 else:  # unzip
-                    for json_file in Path(folder).glob('*.json'):
+                    from zipper import count_archive_entries, list_archives
+                    for json_file in list_archives(folder):
                         try:
-                            with open(json_file, 'r') as f:
-                                total_files += len(json.load(f))
+                            total_files += count_archive_entries(json_file)
                         except Exception:
                             pass
             
             # Process each folder
             for folder in selected_folders:
-                if hasattr(builtins, '_console_log'):
-                    builtins._console_log.after(0, lambda: builtins._console_log.insert('end', f"Working on: {folder}\n"))
-                    builtins._console_log.after(0, lambda: builtins._console_log.see('end'))
+                logger.info(f"Working on: {folder}")
                 try:
                     def folder_progress(current, _):
                         nonlocal processed_files
                         processed_files += 1
                         progress_queue.put((processed_files, total_files))
                     
-                    zipper_operation(folder, op, folder_progress)
+                    zipper_operation(folder, op, folder_progress, autotune)
                 except Exception as e:
                     progress_queue.put(e)
                     break
@@ -297,6 +362,7 @@ def remove_path(paths, config_path, listbox):
 
 def main():
     import base64
+    log_handler = setup_logging()
     config_path = Path('directory.config')
     encoded_pw = ""
     paths = []
@@ -307,7 +373,7 @@ def main():
         else:
             paths, encoded_pw = [], ""
     except Exception as e:
-        print('ERROR in main ensure_config:', e)
+        logger.error(f"ERROR in main ensure_config: {e}")
         paths, encoded_pw = [], ""    
 
     root = tk.Tk()
@@ -346,8 +412,10 @@ def main():
     button_frame = tk.Frame(root)
     Button(button_frame, text="Add Path", width=15, command=lambda: add_path(paths, config_path, dir_listbox)).grid(row=0, column=0, padx=5)
     Button(button_frame, text="Remove Selected", width=15, command=lambda: remove_path(paths, config_path, dir_listbox)).grid(row=0, column=1, padx=5)
-    Button(button_frame, text="Zip Selected", width=15, command=lambda: run_selected('zip', paths, dir_listbox, progress_bar)).grid(row=0, column=2, padx=5)
+    Button(button_frame, text="Zip Selected", width=15, command=lambda: run_selected('zip', paths, dir_listbox, progress_bar, autotune=autotune_var.get())).grid(row=0, column=2, padx=5)
     Button(button_frame, text="Unzip Selected", width=15, command=lambda: run_selected('unzip', paths, dir_listbox, progress_bar)).grid(row=0, column=3, padx=5)
+    autotune_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(button_frame, text="Autotune", variable=autotune_var).grid(row=0, column=4, padx=5)
 
     # Create custom style for progress bar with text
     style = ttk.Style()
@@ -364,15 +432,29 @@ def main():
     progress_bar.pack(pady=(0,10))
 
     console_frame = tk.Frame(root)
-    console_label = Label(console_frame, text="Console Log:")
-    console_label.pack(anchor='w')
+    console_header = tk.Frame(console_frame)
+    console_header.pack(fill='x')
+    console_label = Label(console_header, text="Console Log:")
+    console_label.pack(side='left')
+    log_file_var = tk.BooleanVar(value=False)
+    log_level_var = tk.StringVar(value='INFO')
+
+    def apply_log_settings(*_):
+        level = getattr(logging, log_level_var.get())
+        log_handler.setLevel(level)
+        set_log_file(log_file_var.get(), level)
+
+    tk.Checkbutton(console_header, text=f"Log to {LOG_FILE}", variable=log_file_var, command=apply_log_settings).pack(side='right')
+    log_level_box = ttk.Combobox(console_header, textvariable=log_level_var, values=LOG_LEVELS, state='readonly', width=10)
+    log_level_box.bind('<<ComboboxSelected>>', apply_log_settings)
+    log_level_box.pack(side='right', padx=5)
+    Label(console_header, text="Level:").pack(side='right')
     console_log = tk.Text(console_frame, height=15, width=100)
     console_log.pack(fill='both', expand=True)
-    import builtins
-    builtins._console_log = console_log
+    drain_log(console_log)
 
     basic_button_frame = tk.Frame(root)
-    Button(basic_button_frame, text="Zip All", width=15, command=lambda: run_selected('zip', paths, None, progress_bar)).grid(row=0, column=0, padx=5)
+    Button(basic_button_frame, text="Zip All", width=15, command=lambda: run_selected('zip', paths, None, progress_bar, autotune=autotune_var.get())).grid(row=0, column=0, padx=5)
     Button(basic_button_frame, text="Unzip All", width=15, command=lambda: run_selected('unzip', paths, None, progress_bar)).grid(row=0, column=1, padx=5)
     basic_button_frame.pack(pady=10)
 
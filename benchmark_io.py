@@ -0,0 +1,85 @@
+"""
+Description: Compare buffered and memory-mapped I/O in zipper.py (time, Python-side copies, peak RSS).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+import logging
+import subprocess
+from pathlib import Path
+
+import zipper
+
+def make_sample(folder, file_count, file_size):
+    """Create semi-compressible sample files so deflate has real work to do"""
+    folder.mkdir(parents=True, exist_ok=True)
+    block = os.urandom(64 * 1024) + b'\0' * (64 * 1024)
+    for i in range(file_count):
+        with open(folder / f"sample_{i:04d}.bin", 'wb') as f:
+            remaining = file_size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+
+def run_mode(mode, file_count, file_size):
+    """Zip and unzip a sample set in this process and return the measurements"""
+    if mode == 'buffered':
+        zipper.MMAP_THRESHOLD = sys.maxsize  # Force the buffered fallback everywhere
+
+    work = Path(tempfile.mkdtemp(prefix='bz_bench_'))
+    try:
+        source, archives, restored = work / 'src', work / 'out', work / 'restored'
+        make_sample(source, file_count, file_size)
+
+        results = {'mode': mode}
+        zipper.logger.setLevel(logging.WARNING)  # Keep per-file progress out of the measurements
+        tracemalloc.start()
+        start = time.time()
+        zipper.zip_folder([source, archives])
+        results['zip_s'] = time.time() - start
+        results['zip_py_peak_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+
+        tracemalloc.reset_peak()
+        start = time.time()
+        for json_file in sorted(archives.glob('*.json')):
+            zipper.extract_json(json_file, restored)
+        results['unzip_s'] = time.time() - start
+        results['unzip_py_peak_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+
+        try:
+            import resource
+            # ru_maxrss is KB on Linux, bytes on macOS
+            scale = 1 if sys.platform == 'darwin' else 1024
+            results['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1024 * 1024)
+        except ImportError:
+            results['peak_rss_mb'] = None  # Not available on Windows
+        return results
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        print(json.dumps(run_mode(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))))
+        return
+
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    file_size = int(sys.argv[2]) if len(sys.argv) > 2 else 32 * 1024 * 1024
+    print(f"Benchmarking {file_count} files x {file_size / (1024*1024):.1f} MB")
+
+    # Each mode gets a fresh process so peak RSS is not shared between them
+    for mode in ('buffered', 'mmap'):
+        out = subprocess.run([sys.executable, __file__, '--child', mode, str(file_count), str(file_size)],
+                             capture_output=True, text=True, check=True)
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        rss = f"{r['peak_rss_mb']:.1f} MB" if r['peak_rss_mb'] is not None else "n/a"
+        print(f"{mode:>8}: zip {r['zip_s']:.2f}s (py peak {r['zip_py_peak_mb']:.1f} MB), "
+              f"unzip {r['unzip_s']:.2f}s (py peak {r['unzip_py_peak_mb']:.1f} MB), peak RSS {rss}")
+    print("py peak = Python heap (intermediate copies); peak RSS also counts clean, reclaimable mapped file pages")
+
+if __name__ == "__main__":
+    main()
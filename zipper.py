@@ -5,18 +5,56 @@ import shutil
 import zipfile
 from pathlib import Path
 import multiprocessing as mp
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import time
 import io
+import re
+import posixpath
+import mmap
+import queue
+import select
+import struct
 import base64
+import binascii
+import errno
 import json
+import logging
 import random
 import string
 import gc  # For memory management
 
+logger = logging.getLogger('zipper')
+
 # Constants
 CHUNK_SIZE = 16 * 1024 * 1024  # 16MB chunks for performance  # 16MB chunks for better performance
-MAX_ARCHIVE_SIZE = 256 * 1024 * 1024  # 256MB per JSON file
+MAX_ARCHIVE_SIZE = 100 * 1024 * 1024  # 100MB per JSON file for better handling
 MAX_BATCH_FILES = 1000  # Maximum number of files per batch
+MMAP_THRESHOLD = 4 * 1024 * 1024  # Memory-map sources/archives from 4MB up, buffered I/O below
+FS_WORKERS = 16  # Threads for mkdir/unlink/rmdir, which are latency bound on network shares
+
+# Autotuning (zip --autotune)
+AUTOTUNE_WINDOW = 2.0  # Seconds of work per throughput measurement
+AUTOTUNE_SAMPLE_BYTES = 512 * 1024 * 1024  # Stop adjusting after this much source data
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+TUNING_CONFIG = Path('directory.config')  # GUI config the tuned values are cached in, if present
+
+# Watch mode
+WATCH_DEBOUNCE = 5.0  # Seconds a file must stay untouched before it is archived
+WATCH_POLL_INTERVAL = 5.0  # Seconds between rescans when inotify is unavailable
+WATCH_CPU_LIMIT = 0.25  # Fraction of one core the background compressor may use
+WATCH_IO_LIMIT = 20 * 1024 * 1024  # Bytes/sec read + written by the background compressor
+
+# One entry of a compact archive as written by process_files_batch: {"r":"<path>","c":"<b64+suffix>"}
+ENTRY_PATTERN = re.compile(rb'\{"r":("(?:[^"\\]|\\.)*"),"c":"([^"]*)"\}')
+
+# Bookkeeping files kept next to the archives (.json so zip_folder never archives them)
+CHECKOUT_FILE = '_bz_checkout.json'  # Files rehydrated by checkout_paths, with size/mtime at checkout
+TOMBSTONE_FILE = '_bz_tombstones.json'  # Archive entries superseded or deleted by patch_folder
+MANIFEST_FILE = '_bz_manifest.json'  # Archive set written by the last repack
+REPACK_JOURNAL = '_bz_repack.json'  # Present only while a repack swap is in progress
+REPACK_STAGING = '_bz_repack'  # Folder the new archive set is built in before the swap
 
 def add_random_suffix(data):
     """Add some random data to make the encoded content look more random"""
@@ -29,9 +67,373 @@ def zip_large_file(zip_handle, file_path, arcname):
         with zip_handle.open(arcname, 'w') as dest:
             shutil.copyfileobj(f, dest, CHUNK_SIZE)
 
+def write_source(zip_handle, file_path, arcname, chunk_size=CHUNK_SIZE):
+    """Add a file to the zip archive, compressing large files straight from a memory map.
+    Mapped files are faulted in one chunk at a time (touching a byte per page, with the next
+    chunk requested as readahead where madvise exists) so the I/O is timed separately from
+    compression. Returns the seconds spent reading the source."""
+    file_path = str(file_path)
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    with open(file_path, 'rb') as f:
+        if zinfo.file_size >= MMAP_THRESHOLD:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                mm = None  # Some filesystems (and files that shrank to 0 bytes) cannot be mapped
+            if mm is not None:
+                read_time = 0.0
+                with mm:
+                    view = memoryview(mm)
+                    try:
+                        with zip_handle.open(zinfo, 'w') as dest:
+                            for offset in range(0, len(view), chunk_size):
+                                start = time.perf_counter()
+                                next_offset = offset + chunk_size
+                                if hasattr(mm, 'madvise') and next_offset < len(mm):
+                                    mm.madvise(mmap.MADV_WILLNEED, next_offset,
+                                               min(chunk_size, len(mm) - next_offset))
+                                mm[offset:next_offset:mmap.PAGESIZE]  # Fault the chunk in
+                                read_time += time.perf_counter() - start
+                                dest.write(view[offset:next_offset])
+                    finally:
+                        view.release()
+                return read_time
+        
+        read_time = 0.0
+        with zip_handle.open(zinfo, 'w') as dest:
+            while True:
+                start = time.perf_counter()
+                chunk = f.read(chunk_size)
+                read_time += time.perf_counter() - start
+                if not chunk:
+                    break
+                dest.write(chunk)
+        return read_time
+
+class Autotuner:
+    """Adjust the worker count and I/O chunk size from the throughput measured during
+    the first part of a run. Each measurement window either keeps the last move (if it
+    was faster) or reverts to the best settings so far and tries the next move."""
+    
+    def __init__(self, workers, chunk_size, max_workers):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.stage_time = {'read': 0.0, 'compress': 0.0, 'write': 0.0}
+        self.total_bytes = 0
+        self.window_bytes = 0
+        self.window_start = time.perf_counter()
+        self.best = None  # (throughput, workers, chunk_size)
+        self.moves = None  # Remaining (knob, direction) moves to try
+        self.pending_batches = 0  # Batches not started yet, kept up to date by the dispatcher
+        self.largest_file = 0  # Chunk sizes at or above this read every file in one go
+        self.done = False
+        self.lock = threading.Lock()
+    
+    def record(self, nbytes, read=0.0, compress=0.0, write=0.0):
+        """Account for nbytes of source data (one file, or 0 for a write) and the time each stage spent on it"""
+        with self.lock:
+            self.largest_file = max(self.largest_file, nbytes)
+            self.stage_time['read'] += read
+            self.stage_time['compress'] += compress
+            self.stage_time['write'] += write
+            self.total_bytes += nbytes
+            self.window_bytes += nbytes
+            elapsed = time.perf_counter() - self.window_start
+            if self.done or elapsed < AUTOTUNE_WINDOW:
+                return
+            self.adjust(self.window_bytes / elapsed)
+            self.window_bytes = 0
+            self.window_start = time.perf_counter()
+    
+    def adjust(self, throughput):
+        """Take one hill-climbing step given the throughput of the last window"""
+        io_time = self.stage_time['read'] + self.stage_time['write']
+        bound = 'I/O' if io_time > self.stage_time['compress'] else 'CPU'
+        logger.info(f"Autotune: {throughput / (1024*1024):.1f} MB/s with {self.workers} workers,"
+                    f" {self.chunk_size // 1024} KB chunks ({bound} bound)")
+        
+        if self.moves is None:
+            # I/O-bound runs hide latency with more workers; CPU-bound runs want one per core
+            cores = mp.cpu_count()
+            first = 1 if bound == 'I/O' or self.workers < cores else -1
+            self.moves = [('workers', first), ('workers', -first), ('chunk_size', 1), ('chunk_size', -1)]
+        
+        if self.best is None or throughput > self.best[0] * 1.05:
+            self.best = (throughput, self.workers, self.chunk_size)
+        else:
+            # Last move did not pay off: go back to the best settings and try the next move
+            _, self.workers, self.chunk_size = self.best
+            self.moves.pop(0)
+        
+        while self.moves and self.total_bytes < AUTOTUNE_SAMPLE_BYTES:
+            knob, direction = self.moves[0]
+            if knob == 'workers':
+                step = max(1, self.workers // 2)
+                value = min(self.max_workers, max(1, self.workers + direction * step))
+                # Once every batch has started, the worker count cannot change anything
+                useful = self.pending_batches > 0
+            else:
+                value = self.chunk_size * 2 if direction > 0 else self.chunk_size // 2
+                value = min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, value))
+                # Both sizes read every file seen so far in a single chunk: nothing to measure
+                useful = self.largest_file > min(value, self.chunk_size)
+            if useful and value != getattr(self, knob):
+                setattr(self, knob, value)
+                return
+            self.moves.pop(0)  # At the limit in this direction, or the move would have no effect
+        
+        self.finish()
+    
+    def finish(self):
+        """Stop adjusting and settle on the best settings measured"""
+        if self.done:
+            return
+        self.done = True
+        if self.best is not None:
+            _, self.workers, self.chunk_size = self.best
+        logger.info(f"Autotune: using {self.workers} workers and {self.chunk_size // 1024} KB chunks")
+
+def tuning_key(folder):
+    """Config key for a folder, encoded the same way as the configured paths"""
+    return base64.b64encode(str(Path(folder)).encode('utf-8')).decode('utf-8')
+
+def load_tuning(folder, config_path=TUNING_CONFIG):
+    """Return the cached {'workers', 'chunk_size'} for a folder, or {}"""
+    try:
+        with open(config_path, 'r') as f:
+            return json.load(f).get('tuning', {}).get(tuning_key(folder), {})
+    except (OSError, ValueError):
+        return {}
+
+def save_tuning(folder, tuning, config_path=TUNING_CONFIG):
+    """Cache tuned values for a folder in the GUI config; does nothing if there is no config"""
+    try:
+        with open(config_path, 'r') as f:
+            config_obj = json.load(f)
+    except (OSError, ValueError):
+        return
+    config_obj.setdefault('tuning', {})[tuning_key(folder)] = tuning
+    # Replace atomically: the config also holds the password and paths
+    config_path = Path(config_path)
+    tmp_path = config_path.with_name(config_path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(config_obj, f, indent=2)
+    os.replace(tmp_path, config_path)
+
+def normalize_path(rel_path):
+    """Archive paths are stored with OS separators; compare them with forward slashes"""
+    return rel_path.replace('\\', '/')
+
+def archive_index(json_path):
+    """Return N for an archive_N.json file, or None for any other file"""
+    name = Path(json_path).name
+    if name.startswith('archive_') and name.endswith('.json'):
+        index = name[len('archive_'):-len('.json')]
+        if index.isdigit():
+            return int(index)
+    return None
+
+def list_archives(folder):
+    """Return the archive_N.json files in a folder, oldest (lowest N) first"""
+    archives = [f for f in Path(folder).glob('archive_*.json') if archive_index(f) is not None]
+    return sorted(archives, key=archive_index)
+
+def load_state(folder, name):
+    """Load a bookkeeping file (checkout record or tombstones), empty if missing"""
+    path = Path(folder) / name
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(folder, name, state):
+    """Write a bookkeeping file atomically, removing it when there is nothing to keep"""
+    path = Path(folder) / name
+    if not state:
+        if path.exists():
+            path.unlink()
+        return
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+def load_tombstones(folder):
+    """Return {archive name: set of dead paths} for a folder"""
+    return {name: set(paths) for name, paths in load_state(folder, TOMBSTONE_FILE).items()}
+
+def next_archive_index(folder):
+    """Return N for the next new archive_N.json: above every archive present and every name
+    the tombstones still refer to, so a new archive never inherits another's dead entries"""
+    names = [f.name for f in list_archives(folder)] + list(load_state(folder, TOMBSTONE_FILE))
+    return max((archive_index(name) or 0 for name in names), default=0) + 1
+
+def live_entries(folder):
+    """Map every live relative path to the archive holding its current copy.
+    Later archives supersede earlier ones and tombstoned entries are ignored."""
+    tombstones = load_tombstones(folder)
+    live = {}
+    for archive in list_archives(folder):
+        dead = tombstones.get(archive.name, set())
+        for rel_path in list_archive_paths(archive):
+            if rel_path not in dead:
+                live[rel_path] = archive
+    return live, tombstones
+
+def checkout_changes(folder, checkout):
+    """Split a checkout record into (modified, deleted) paths by comparing size/mtime"""
+    modified, deleted = set(), set()
+    for rel_path, stamp in checkout.items():
+        try:
+            st = (Path(folder) / rel_path).stat()
+        except FileNotFoundError:
+            deleted.add(rel_path)
+            continue
+        if [st.st_size, st.st_mtime_ns] != stamp:
+            modified.add(rel_path)
+    return modified, deleted
+
+def scan_archive(data):
+    """Locate entries in a compact JSON archive without parsing it into Python objects.
+    Returns a list of (raw_path, (start, end), (entry_start, entry_end)) giving the spans of
+    the encoded content and of the whole entry, or None if
+    the archive is not in the compact layout written by process_files_batch."""
+    spans = []
+    if data[:1] != b'[':
+        return None
+    pos = 1
+    if data[pos:pos + 1] != b']':
+        while True:
+            match = ENTRY_PATTERN.match(data, pos)
+            if not match:
+                return None
+            spans.append((match.group(1), match.span(2), match.span()))
+            pos = match.end()
+            sep = data[pos:pos + 1]
+            if sep == b']':
+                break
+            if sep != b',':
+                return None
+            pos += 1
+    if data[pos + 1:].strip():
+        return None
+    return spans
+
+class ArchiveReader:
+    """Scan an encoded JSON archive once and keep the result for every later pass.
+    Large compact archives stay memory-mapped until close(); small or non-compact
+    archives fall back to json.load. paths holds the normalized relative paths."""
+    
+    def __init__(self, json_path):
+        self.json_path = Path(json_path)
+        self.file = self.mm = self.spans = self.entries = None
+        if self.json_path.stat().st_size >= MMAP_THRESHOLD:
+            self.file = open(self.json_path, 'rb')
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.spans = scan_archive(self.mm)
+            if self.spans is None:
+                self.close()
+        if self.spans is not None:
+            self.paths = []
+            for raw_path, _, _ in self.spans:
+                try:
+                    rel_path = json.loads(raw_path)
+                except ValueError:  # Bad escape: keep the entry so its error is reported
+                    rel_path = raw_path[1:-1].decode('utf-8', 'replace')
+                self.paths.append(normalize_path(rel_path))
+        else:
+            with open(self.json_path, 'r', encoding='utf-8') as jf:
+                self.entries = json.load(jf)
+            self.paths = [normalize_path(entry['r']) for entry in self.entries]
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.file.close()
+            self.mm = self.file = None
+    
+    def iter_entries(self, select=None):
+        """Yield (normalized rel_path, compressed_data) for every entry, decoding base64
+        straight from the mapped slices where possible. If select is given, only entries whose normalized
+        path is in it are decoded. compressed_data is an exception instance if that entry
+        could not be decoded."""
+        if self.spans is not None:
+            view = memoryview(self.mm)
+            try:
+                for path, (_, (start, end), _) in zip(self.paths, self.spans):
+                    if select is not None and path not in select:
+                        continue
+                    try:
+                        data = binascii.a2b_base64(view[start:end - 8])
+                    except ValueError as e:  # binascii.Error
+                        data = e
+                    yield path, data
+            finally:
+                view.release()
+            return
+        
+        for path, entry in zip(self.paths, self.entries):
+            if select is not None and path not in select:
+                continue
+            try:
+                data = base64.b64decode(entry['c'][:-8].encode('utf-8'))
+            except ValueError as e:
+                data = e
+            yield path, data
+
+def iter_archive_entries(json_path, select=None):
+    """Yield (normalized rel_path, compressed_data) for every entry of an encoded JSON archive"""
+    with ArchiveReader(json_path) as reader:
+        yield from reader.iter_entries(select)
+
+def list_archive_paths(json_path):
+    """Return the normalized relative paths stored in an archive without decoding any content"""
+    with ArchiveReader(json_path) as reader:
+        return reader.paths
+
+def count_archive_entries(json_path):
+    """Count the entries of an encoded JSON archive, scanning large ones via mmap"""
+    json_path = Path(json_path)
+    if json_path.stat().st_size >= MMAP_THRESHOLD:
+        with open(json_path, 'rb') as jf:
+            with mmap.mmap(jf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                spans = scan_archive(mm)
+                if spans is not None:
+                    return len(spans)
+    with open(json_path, 'r', encoding='utf-8') as jf:
+        return len(json.load(jf))
+
+def encode_file(file, folder, buffer, chunk_size=CHUNK_SIZE):
+    """Compress one file into the reused buffer and base64-encode it.
+    Returns (rel_path, encoded, read_time)."""
+    rel_path = str(file.relative_to(folder))
+    
+    # Reset buffer position
+    buffer.seek(0)
+    buffer.truncate()
+    
+    # Use ZIP compression in memory with reused buffer
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        read_time = write_source(zf, file, rel_path, chunk_size)
+    
+    # Encode straight from the buffer without copying it out first
+    with buffer.getbuffer() as compressed_data:
+        encoded = add_random_suffix(base64.b64encode(compressed_data).decode('utf-8'))
+    return rel_path, encoded, read_time
+
 def process_files_batch(args):
-    """Process a batch of files into encoded JSON using ZIP compression internally"""
-    files, folder, output_path, progress_callback = args
+    """Process a batch of files into encoded JSON using ZIP compression internally.
+    An optional fifth argument is an Autotuner to report per-stage timings to."""
+    files, folder, output_path, progress_callback = args[:4]
+    tuner = args[4] if len(args) > 4 else None
     total_size = 0
     json_entries = []
     
@@ -45,23 +447,16 @@ def process_files_batch(args):
     
     for file in files:
         try:
-            rel_path = str(file.relative_to(folder))
-            
-            # Reset buffer position
-            buffer.seek(0)
-            buffer.truncate()
-            
-            # Use ZIP compression in memory with reused buffer
-            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-                zf.write(str(file), rel_path)
-            
-            # Get compressed data and encode it
-            compressed_data = buffer.getvalue()
-            encoded = add_random_suffix(base64.b64encode(compressed_data).decode('utf-8'))
+            start = time.perf_counter()
+            rel_path, encoded, read_time = encode_file(file, folder, buffer,
+                                                       tuner.chunk_size if tuner else CHUNK_SIZE)
             
             # Create JSON entry with minimal overhead
             json_entries.append({'r': rel_path, 'c': encoded})
-            total_size += file.stat().st_size
+            file_size = file.stat().st_size
+            total_size += file_size
+            if tuner:
+                tuner.record(file_size, read=read_time, compress=time.perf_counter() - start - read_time)
             
             # Update progress
             processed_files += 1
@@ -69,21 +464,172 @@ def process_files_batch(args):
                 progress_callback(processed_files, total_files)
             
         except Exception as e:
-            print(f"Error processing {file}: {e}")
+            logger.error(f"Error processing {file}: {e}")
     
     if json_entries:
         try:
             # Use faster JSON dump
-            with open(output_path, 'w', encoding='utf-8') as jf:
+            start = time.perf_counter()
+            # 'x' refuses to clobber an existing archive (and the tombstones keyed by its name)
+            with open(output_path, 'x', encoding='utf-8') as jf:
                 json.dump(json_entries, jf, separators=(',', ':'))  # Use compact JSON format
+            if tuner:
+                tuner.record(0, write=time.perf_counter() - start)
         except Exception as e:
-            print(f"Error saving {output_path}: {e}")
+            logger.error(f"Error saving {output_path}: {e}")
             return None, 0
     
     return output_path, total_size
 
-def zip_folder(folder_path, progress_callback=None):
-    """Create encoded JSON archives of a folder using ZIP compression internally"""
+def plan_batches(files):
+    """Group files into archive-sized batches, smallest files first"""
+    batches = []
+    current_batch = []
+    current_batch_size = 0
+    
+    for file in sorted(files, key=lambda x: x.stat().st_size):
+        file_size = file.stat().st_size
+        estimated_size = file_size * 1.4  # Base64 overhead estimate
+        
+        # Start new batch if current would be too large or has too many files
+        if current_batch and (current_batch_size + estimated_size > MAX_ARCHIVE_SIZE or 
+                            len(current_batch) >= MAX_BATCH_FILES):
+            batches.append(current_batch)
+            current_batch = []
+            current_batch_size = 0
+        
+        current_batch.append(file)
+        current_batch_size += estimated_size
+
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+def record_fs_time(fs_stats, op, count, start):
+    """Add count operations taking since start to the metadata timings in fs_stats"""
+    if fs_stats is not None:
+        entry = fs_stats.setdefault(op, [0, 0.0])
+        entry[0] += count
+        entry[1] += time.perf_counter() - start
+
+def log_fs_timings(fs_stats):
+    """Report metadata-operation timings separately from the data work"""
+    if fs_stats:
+        logger.info("Metadata operations: " + ", ".join(
+            f"{op} {count} in {seconds:.2f}s" for op, (count, seconds) in fs_stats.items()))
+
+def scan_folder(folder, fs_stats=None):
+    """Walk folder once and return (files, dirs): the non-.json files to archive and
+    every directory below folder. Symlinked directories are not followed."""
+    start = time.perf_counter()
+    files, dirs = [], []
+    stack = [Path(folder)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(Path(entry.path))
+                    stack.append(dirs[-1])
+                elif entry.is_file() and not entry.name.lower().endswith('.json'):
+                    files.append(Path(entry.path))
+    record_fs_time(fs_stats, 'scan', len(files) + len(dirs), start)
+    return files, dirs
+
+def make_dirs(folder, rel_paths, fs_stats=None):
+    """Create every directory needed to hold rel_paths (normalized) below folder in one pass.
+    Only the deepest directories are created explicitly, spread over FS_WORKERS threads;
+    their parents come along with them."""
+    start = time.perf_counter()
+    parents = {posixpath.dirname(p) for p in rel_paths} - {''}
+    ancestors = set()
+    for d in parents:
+        parent = posixpath.dirname(d)
+        while parent and parent not in ancestors:
+            ancestors.add(parent)
+            parent = posixpath.dirname(parent)
+    leaves = sorted(parents - ancestors)
+    
+    def mkdir(rel_dir):
+        try:
+            (Path(folder) / rel_dir).mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            logger.error(f"Error creating {rel_dir}: {e}")
+    
+    if leaves:
+        with ThreadPoolExecutor(max_workers=min(FS_WORKERS, len(leaves))) as executor:
+            list(executor.map(mkdir, leaves))
+    record_fs_time(fs_stats, 'mkdir', len(leaves), start)
+
+def remove_paths(files, dirs, fs_stats=None):
+    """Delete files across FS_WORKERS threads, then remove the directories that became empty.
+    Directories are removed one depth level at a time, deepest first, each level in parallel."""
+    def unlink(f):
+        try:
+            f.unlink()
+        except Exception as e:
+            logger.error(f"Error removing {f}: {e}")
+    
+    def rmdir(d):
+        try:
+            d.rmdir()
+        except OSError:
+            pass  # Directory not empty
+    
+    by_depth = {}
+    for d in dirs:
+        by_depth.setdefault(len(d.parts), []).append(d)
+    
+    with ThreadPoolExecutor(max_workers=FS_WORKERS) as executor:
+        start = time.perf_counter()
+        list(executor.map(unlink, files))
+        record_fs_time(fs_stats, 'unlink', len(files), start)
+        
+        start = time.perf_counter()
+        for depth in sorted(by_depth, reverse=True):
+            list(executor.map(rmdir, by_depth[depth]))
+        record_fs_time(fs_stats, 'rmdir', len(dirs), start)
+
+def zip_batches_autotuned(batches, folder, output_dir, progress_callback=None, first_index=1):
+    """Process batches while an Autotuner adjusts how many run at once and the chunk size.
+    Starts from (and updates) the values cached for the folder. Returns the archive paths."""
+    cached = load_tuning(folder)
+    tuner = Autotuner(cached.get('workers', mp.cpu_count() * 2), cached.get('chunk_size', CHUNK_SIZE),
+                      mp.cpu_count() * 4)
+    if cached:
+        logger.info(f"Autotune: starting from cached {tuner.workers} workers and {tuner.chunk_size // 1024} KB chunks")
+    
+    successful_archives = []
+    pending = list(enumerate(batches, first_index))
+    tuner.pending_batches = len(pending)
+    running = {}
+    with ThreadPoolExecutor(max_workers=tuner.max_workers) as executor:
+        while pending or running:
+            # Top up to the current worker target; a lower target drains as batches finish
+            while pending and len(running) < tuner.workers:
+                i, batch = pending.pop(0)
+                json_path = output_dir / f"archive_{i}.json"
+                running[executor.submit(process_files_batch,
+                                        (batch, folder, json_path, progress_callback, tuner))] = i
+            tuner.pending_batches = len(pending)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                try:
+                    archive_path, size = future.result()
+                    if archive_path:
+                        successful_archives.append(archive_path)
+                except Exception as e:
+                    logger.error(f"Error in batch {i}: {e}")
+    
+    measured = tuner.best is not None
+    tuner.finish()
+    if measured:
+        save_tuning(folder, {'workers': tuner.workers, 'chunk_size': tuner.chunk_size})
+    return sorted(successful_archives, key=archive_index)
+
+def zip_folder(folder_path, progress_callback=None, autotune=False):
+    """Create encoded JSON archives of a folder using ZIP compression internally.
+    With autotune, the worker count and chunk size are tuned while the run progresses."""
     output_dir = None
     if isinstance(folder_path, (list, tuple)):
         folder = Path(folder_path[0])
@@ -92,22 +638,27 @@ def zip_folder(folder_path, progress_callback=None):
         folder = Path(folder_path)
     
     if not folder.is_dir():
-        print(f"{folder} is not a valid directory.")
+        logger.warning(f"{folder} is not a valid directory.")
+        return
+    
+    if (folder / CHECKOUT_FILE).exists():
+        logger.warning(f"{folder} has checked-out files; run 'patch' to archive the changes instead.")
         return
     
     if output_dir:
         output_dir.mkdir(parents=True, exist_ok=True)
     else:
         output_dir = folder
-        
-    MAX_ARCHIVE_SIZE = 100 * 1024 * 1024  # 100MB per JSON file for better handling
+    # A committed repack must land before new archive names are chosen
+    if not finish_repack(output_dir):
+        return
     
     # Collect all files first for accurate progress tracking
-    print("Scanning for files...")
-    files = list(folder.rglob('*'))
-    files = [f for f in files if f.is_file() and not str(f).lower().endswith('.json')]
+    logger.info("Scanning for files...")
+    fs_stats = {}
+    files, dirs = scan_folder(folder, fs_stats)
     if not files:
-        print("No files to archive.")
+        logger.info("No files to archive.")
         return
         
     total_files = len(files)
@@ -118,33 +669,14 @@ def zip_folder(folder_path, progress_callback=None):
         progress_callback(processed_files, total_files)
 
     # Group files into batches optimized for performance
-    batches = []
-    current_batch = []
-    current_batch_size = 0
-    
-    for file in sorted(files, key=lambda x: x.stat().st_size):
-        file_size = file.stat().st_size
-        estimated_size = file_size * 1.4  # Base64 overhead estimate
-        
-        # Start new batch if current would be too large or has too many files
-        if current_batch and (current_batch_size + estimated_size > MAX_ARCHIVE_SIZE or 
-                            len(current_batch) >= MAX_BATCH_FILES):
-            batches.append(current_batch)
-            current_batch = []
-            current_batch_size = 0
-        
-        current_batch.append(file)
-        current_batch_size += estimated_size
-
-    if current_batch:
-        batches.append(current_batch)
+    batches = plan_batches(files)
 
     if not batches:
-        print("No files to process after batch calculation.")
+        logger.info("No files to process after batch calculation.")
         return
 
     # Process batches in parallel for maximum performance
-    print(f"Processing {len(batches)} batch(es) of files...")
+    logger.info(f"Processing {len(batches)} batch(es) of files...")
     successful_archives = []
     total_files = sum(len(batch) for batch in batches)
     processed_files = 0
@@ -152,95 +684,83 @@ def zip_folder(folder_path, progress_callback=None):
     # Use optimal number of workers based on CPU cores and batch count
     workers = min(len(batches), mp.cpu_count() * 2)
     
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        futures = []
-        for i, batch in enumerate(batches, 1):
-            json_path = output_dir / f"archive_{i}.json"
-            futures.append(executor.submit(process_files_batch, (batch, folder, json_path, progress_callback)))
-        
-        # Process results as they complete
-        for i, future in enumerate(futures, 1):
-            try:
-                archive_path, size = future.result(timeout=300)  # 5-minute timeout per batch
-                if archive_path:
-                    successful_archives.append(archive_path)
-            except Exception as e:
-                print(f"Error in batch {i}: {e}")
+    # Number after any archives already here (watch or delta archives) so none are overwritten
+    first_index = next_archive_index(output_dir)
+    
+    if autotune:
+        successful_archives = zip_batches_autotuned(batches, folder, output_dir, progress_callback, first_index)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for i, batch in enumerate(batches, first_index):
+                json_path = output_dir / f"archive_{i}.json"
+                futures.append(executor.submit(process_files_batch, (batch, folder, json_path, progress_callback)))
+            
+            # Process results as they complete
+            for i, future in enumerate(futures, 1):
+                try:
+                    archive_path, size = future.result(timeout=300)  # 5-minute timeout per batch
+                    if archive_path:
+                        successful_archives.append(archive_path)
+                except Exception as e:
+                    logger.error(f"Error in batch {i}: {e}")
 
     if successful_archives:
         # Clean up original files if not using separate output directory
         if not (output_dir and output_dir != folder):
-            for file in files:
-                try:
-                    file.unlink()
-                except Exception as e:
-                    print(f"Error removing {file}: {e}")
-            
-            # Remove empty directories
-            dirs = sorted([d for d in folder.rglob('*') if d.is_dir() and d != folder], 
-                        key=lambda x: -len(str(x)))
-            for d in dirs:
-                try:
-                    d.rmdir()
-                except OSError:
-                    pass  # Directory not empty
-            print(f"Created {len(successful_archives)} JSON archives and deleted originals.")
+            # Remove originals and the directories they leave empty, using the scan results
+            remove_paths(files, dirs, fs_stats)
+            logger.info(f"Created {len(successful_archives)} JSON archives and deleted originals.")
         else:
-            print(f"Created {len(successful_archives)} JSON archives in {output_dir} (source files not deleted).")
+            logger.info(f"Created {len(successful_archives)} JSON archives in {output_dir} (source files not deleted).")
     else:
-        print("No archives were created successfully.")
+        logger.info("No archives were created successfully.")
+    log_fs_timings(fs_stats)
 
-def extract_json(json_path, destination, start_offset=0, progress_callback=None):
-    """Extract files from an encoded JSON archive"""
-    import time
+def extract_json(json_path, destination, start_offset=0, progress_callback=None, select=None,
+                 create_dirs=True):
+    """Extract files from an encoded JSON archive (only the normalized paths in select, if given).
+    Target directories are created in bulk up front unless create_dirs is False because the
+    caller already created them."""
     start_time = time.time()
     
     folder = Path(destination)
     extracted_files = 0
     failed_files = 0
     
-    print(f"\nStarting extraction of {json_path}")
-    
-    # Reuse a single buffer for all files
-    zip_buffer = io.BytesIO()
+    logger.info(f"Starting extraction of {json_path}")
     
     try:
-        print(f"Processing {json_path}...")
+        logger.info(f"Processing {json_path}...")
         
-        # Load and process entries
-        with open(json_path, 'r', encoding='utf-8') as jf:
-            entries = json.load(jf)
-            total_entries = len(entries)
+        # Scan the archive once for the entry count, the directories and the entries
+        with ArchiveReader(json_path) as reader:
+            total_entries = len(reader.paths) if select is None else len(select)
+            rel_path = None
             
-            # Process each entry
-            for i, entry in enumerate(entries, 1):
+            if create_dirs:
+                fs_stats = {}
+                make_dirs(folder, select if select is not None else reader.paths, fs_stats)
+                log_fs_timings(fs_stats)
+            
+            # Process each entry, decoding large archives directly from the memory map
+            for i, (rel_path, compressed_data) in enumerate(reader.iter_entries(select), 1):
                 try:
-                    # Get relative path and normalize it
-                    rel_path = entry['r'].replace('\\', '/')
-                    
                     if i % 5 == 0 or i == total_entries:
                         elapsed = time.time() - start_time
                         rate = i / elapsed if elapsed > 0 else 0
-                        print(f"Processing {i}/{total_entries} files ({rate:.1f} files/sec)")
+                        logger.info(f"Processing {i}/{total_entries} files ({rate:.1f} files/sec)")
                     
-                    # Decode and decompress
-                    encoded_content = entry['c']
-                    compressed_data = base64.b64decode(encoded_content[:-8].encode('utf-8'))
+                    if isinstance(compressed_data, Exception):
+                        raise compressed_data
                     
-                    # Reuse buffer for ZIP data
-                    zip_buffer.seek(0)
-                    zip_buffer.truncate()
-                    zip_buffer.write(compressed_data)
-                    zip_buffer.seek(0)
-                    
-                    # Extract file
-                    with zipfile.ZipFile(zip_buffer, 'r') as zf:
+                    # BytesIO shares the decoded bytes instead of copying them
+                    with zipfile.ZipFile(io.BytesIO(compressed_data), 'r') as zf:
                         # Get the first file in the archive (should only be one)
                         zip_info = zf.filelist[0]
                         
-                        # Create target path
+                        # Target directories already exist
                         target = folder / rel_path
-                        target.parent.mkdir(parents=True, exist_ok=True)
                         
                         # Extract with corrected path
                         with zf.open(zip_info) as source, open(target, 'wb') as dest:
@@ -252,8 +772,10 @@ def extract_json(json_path, destination, start_offset=0, progress_callback=None)
                     
                 except Exception as e:
                     failed_files += 1
-                    print(f"\nError extracting {rel_path}: {str(e)}")
+                    logger.error(f"Error extracting {rel_path}: {str(e)}")
                     continue
+                finally:
+                    compressed_data = None
                 
                 # Free up memory periodically
                 if i % 25 == 0:
@@ -265,42 +787,59 @@ def extract_json(json_path, destination, start_offset=0, progress_callback=None)
         
         # Report final status
         elapsed = time.time() - start_time
-        print(f"\nExtraction completed in {elapsed:.1f}s:")
-        print(f"- Successfully extracted: {extracted_files} files")
+        logger.info(f"Extraction completed in {elapsed:.1f}s:")
+        logger.info(f"- Successfully extracted: {extracted_files} files")
         if failed_files:
-            print(f"- Failed to extract: {failed_files} files")
+            logger.warning(f"- Failed to extract: {failed_files} files")
         
         return failed_files == 0
         
     except Exception as e:
-        print(f"Critical error processing {json_path}: {e}")
-        import traceback
-        print(f"Detailed error:\n{traceback.format_exc()}")
+        logger.exception(f"Critical error processing {json_path}: {e}")
         return False
 
 def unzip_folder(folder_path, progress_callback=None):
     """Extract JSON archives sequentially"""
-    import time
     overall_start = time.time()
     
     folder = Path(folder_path)
-    print(f"\nScanning {folder} for JSON archives...")
-    json_files = sorted(folder.glob('*.json'), 
-                       key=lambda x: int(x.stem.split('_')[1]) if x.stem.split('_')[1].isdigit() else 0)
+    if not finish_repack(folder):
+        return
+    logger.info(f"Scanning {folder} for JSON archives...")
+    json_files = list_archives(folder)
     
     if not json_files:
-        print("No JSON archives found to extract.")
+        logger.info("No JSON archives found to extract.")
         return
-        
-    # Count total files from all archives for accurate progress tracking
+    
+    # Skip tombstoned entries and keep checked-out files that were edited but not patched
+    tombstones = load_tombstones(folder)
+    modified, _ = checkout_changes(folder, load_state(folder, CHECKOUT_FILE))
+    if modified:
+        logger.warning(f"Keeping {len(modified)} modified checked-out file(s); run 'patch' to archive them.")
+    
+    # Read every archive's paths once for the progress total, the tombstone selections
+    # and the set of directories to create
+    selections = {}
+    counts = {}
+    all_paths = set()
     total_files = 0
     for json_file in json_files:
         try:
-            with open(json_file, 'r', encoding='utf-8') as jf:
-                entries = json.load(jf)
-                total_files += len(entries)
+            paths = list_archive_paths(json_file)
         except Exception as e:
-            print(f"Error reading {json_file}: {e}")
+            logger.error(f"Error reading {json_file}: {e}")
+            continue
+        dead = tombstones.get(json_file.name, set()) | modified
+        if dead:
+            paths = [p for p in paths if p not in dead]
+            selections[json_file] = set(paths)
+        counts[json_file] = len(paths)
+        total_files += len(paths)
+        all_paths.update(paths)
+    
+    fs_stats = {}
+    make_dirs(folder, all_paths, fs_stats)
     
     # Report initial progress
     if progress_callback:
@@ -308,12 +847,12 @@ def unzip_folder(folder_path, progress_callback=None):
     
     # Calculate total size for logging
     total_size = sum(f.stat().st_size for f in json_files)
-    print(f"\nFound {len(json_files)} JSON archives to extract"
-          f" (Total size: {total_size / (1024*1024):.1f} MB)")
+    logger.info(f"Found {len(json_files)} JSON archives to extract"
+                f" (Total size: {total_size / (1024*1024):.1f} MB)")
     for f in json_files:
-        print(f"- {f.name}: {f.stat().st_size / (1024*1024):.1f} MB")
+        logger.info(f"- {f.name}: {f.stat().st_size / (1024*1024):.1f} MB")
     
-    print("\nProcessing archives sequentially to ensure stability...")
+    logger.info("Processing archives sequentially to ensure stability...")
     
     successful_files = []
     failed_files = []
@@ -321,69 +860,734 @@ def unzip_folder(folder_path, progress_callback=None):
     
     # Process one file at a time with progress tracking
     for file_num, json_file in enumerate(json_files, 1):
-        print(f"\nProcessing archive {file_num}/{len(json_files)}: {json_file.name}")
+        logger.info(f"Processing archive {file_num}/{len(json_files)}: {json_file.name}")
         extraction_start = time.time()
         
         try:
-            # Get number of files in current archive for progress offset
-            with open(json_file, 'r', encoding='utf-8') as jf:
-                entries = json.load(jf)
-                archive_file_count = len(entries)
-            
             # Process the file with progress callback
-            if extract_json(json_file, folder, current_offset, progress_callback):
+            if extract_json(json_file, folder, current_offset, progress_callback, selections.get(json_file),
+                            create_dirs=False):
                 successful_files.append(json_file)
-                current_offset += archive_file_count
-                print(f"Successfully completed {json_file.name} in"
-                      f" {time.time() - extraction_start:.1f}s")
+                current_offset += counts.get(json_file, 0)  # Entries counted in the first pass
+                logger.info(f"Successfully completed {json_file.name} in"
+                            f" {time.time() - extraction_start:.1f}s")
             else:
                 failed_files.append(json_file)
-                print(f"Failed to extract {json_file.name}")
+                logger.warning(f"Failed to extract {json_file.name}")
             
             # Force memory cleanup after each file
             gc.collect()
             
         except Exception as e:
-            print(f"Fatal error extracting {json_file.name}:")
-            import traceback
-            print(traceback.format_exc())
+            logger.exception(f"Fatal error extracting {json_file.name}:")
             failed_files.append(json_file)
         
         # Report results periodically
         if successful_files and (len(successful_files) % 5 == 0 or file_num == len(json_files)):
             total_time = time.time() - overall_start
-            print(f"\nSuccessfully extracted {len(successful_files)}/{len(json_files)} archives"
-                  f" in {total_time:.1f}s")
+            logger.info(f"Successfully extracted {len(successful_files)}/{len(json_files)} archives"
+                        f" in {total_time:.1f}s")
             
             # Only remove successfully processed archives
             for completed_file in successful_files[-5:]:  # Only process last batch
                 try:
                     completed_file.unlink()
                 except Exception as e:
-                    print(f"Warning: Could not remove {completed_file.name}: {e}")
+                    logger.warning(f"Could not remove {completed_file.name}: {e}")
+                    continue
+                # Its tombstones must not apply to a later archive reusing the name
+                if tombstones.pop(completed_file.name, None) is not None:
+                    save_state(folder, TOMBSTONE_FILE,
+                               {name: sorted(paths) for name, paths in tombstones.items()})
     
     if failed_files:
-        print(f"\nWarning: Failed to extract {len(failed_files)} archives:")
+        logger.warning(f"Failed to extract {len(failed_files)} archives:")
         for failed in failed_files:
-            print(f"- {failed.name}")
-        print("\nJSON files for failed extractions were not removed")
+            logger.warning(f"- {failed.name}")
+        logger.warning("JSON files for failed extractions were not removed")
+    else:
+        # Every archive is gone, so the bookkeeping files are obsolete
+        save_state(folder, TOMBSTONE_FILE, {})
+        save_state(folder, CHECKOUT_FILE, {})
+        save_state(folder, MANIFEST_FILE, {})
+    log_fs_timings(fs_stats)
+
+def checkout_paths(folder_path, paths, progress_callback=None):
+    """Extract only the given files/subfolders of an archived folder, keeping the archives.
+    The checked-out files are recorded so patch_folder can archive just what changed."""
+    folder = Path(folder_path)
+    wanted = []
+    for p in paths:
+        p = Path(p)
+        if p.is_absolute():
+            try:
+                p = p.relative_to(folder)
+            except ValueError:
+                logger.warning(f"Skipping {p}: not inside {folder}")
+                continue
+        rel_path = normalize_path(str(p)).strip('/')
+        wanted.append('' if rel_path == '.' else rel_path)
+    
+    if not finish_repack(folder):
+        return
+    live, _ = live_entries(folder)
+    chosen = [rel_path for rel_path in live
+              if any(not w or rel_path == w or rel_path.startswith(w + '/') for w in wanted)]
+    
+    # Never overwrite files from an earlier checkout that were edited but not patched yet
+    checkout = load_state(folder, CHECKOUT_FILE)
+    modified, _ = checkout_changes(folder, checkout)
+    kept = [rel_path for rel_path in chosen if rel_path in modified]
+    if kept:
+        logger.warning(f"Keeping {len(kept)} modified checked-out file(s); run 'patch' to archive them.")
+        chosen = [rel_path for rel_path in chosen if rel_path not in modified]
+    if not chosen:
+        logger.info("No archived files match the requested paths.")
+        return
+    
+    # Group by archive so each one is scanned once
+    by_archive = {}
+    for rel_path in chosen:
+        by_archive.setdefault(live[rel_path], set()).add(rel_path)
+    logger.info(f"Checking out {len(chosen)} file(s) from {len(by_archive)} archive(s)...")
+    if progress_callback:
+        progress_callback(0, len(chosen))
+    
+    fs_stats = {}
+    make_dirs(folder, chosen, fs_stats)
+    offset = 0
+    for json_file in list_archives(folder):
+        select = by_archive.get(json_file)
+        if not select:
+            continue
+        extract_json(json_file, folder, offset, progress_callback, select, create_dirs=False)
+        offset += len(select)
+        for rel_path in select:
+            try:
+                st = (folder / rel_path).stat()
+                checkout[rel_path] = [st.st_size, st.st_mtime_ns]
+            except FileNotFoundError:
+                pass  # Extraction failed, already reported
+    save_state(folder, CHECKOUT_FILE, checkout)
+    logger.info(f"Checked out {len(chosen)} file(s); archives were kept.")
+    log_fs_timings(fs_stats)
+
+def patch_folder(folder_path, progress_callback=None):
+    """Archive files changed since checkout_paths into new delta archives.
+    Old copies of changed or deleted files are tombstoned instead of rewriting their archives."""
+    folder = Path(folder_path)
+    if not finish_repack(folder):
+        return
+    checkout = load_state(folder, CHECKOUT_FILE)
+    
+    # Loose files that are new or differ from their checked-out state
+    logger.info("Scanning for changed files...")
+    fs_stats = {}
+    loose, dirs = scan_folder(folder, fs_stats)
+    changed = []
+    for f in loose:
+        st = f.stat()
+        if checkout.get(normalize_path(str(f.relative_to(folder)))) != [st.st_size, st.st_mtime_ns]:
+            changed.append(f)
+    _, deleted = checkout_changes(folder, checkout)
+    if not changed and not deleted:
+        logger.info("No changes to patch.")
+        save_state(folder, CHECKOUT_FILE, {})
+        remove_paths(loose, dirs, fs_stats)
+        log_fs_timings(fs_stats)
+        return
+    
+    if progress_callback:
+        progress_callback(0, len(changed))
+    
+    # Resolve the current copies before the delta archives shadow them
+    live, tombstones = live_entries(folder)
+    written = set()
+    if changed:
+        batches = plan_batches(changed)
+        next_index = next_archive_index(folder)
+        logger.info(f"Writing {len(changed)} changed file(s) to {len(batches)} delta archive(s)...")
+        for i, batch in enumerate(batches):
+            json_path = folder / f"archive_{next_index + i}.json"
+            archive_path, _ = process_files_batch((batch, folder, json_path, progress_callback))
+            if archive_path:
+                written.update(list_archive_paths(archive_path))
+    
+    # Tombstone the previous live copy of everything rewritten or deleted
+    superseded = 0
+    for rel_path in written | deleted:
+        old = live.get(rel_path)
+        if old is not None:
+            tombstones.setdefault(old.name, set()).add(rel_path)
+            superseded += 1
+    save_state(folder, TOMBSTONE_FILE, {name: sorted(paths) for name, paths in tombstones.items()})
+    
+    # The archives now hold everything; drop the loose copies that are safely stored
+    # Changed files that failed to archive are kept for the next patch
+    unsaved = {f for f in changed if normalize_path(str(f.relative_to(folder))) not in written}
+    remove_paths([f for f in loose if f not in unsaved], dirs, fs_stats)
+    save_state(folder, CHECKOUT_FILE, {})
+    
+    logger.info(f"Patched {len(written)} file(s), tombstoned {superseded} old entr{'y' if superseded == 1 else 'ies'}"
+                f" ({len(deleted)} deleted).")
+    if unsaved:
+        logger.warning(f"{len(unsaved)} changed file(s) could not be archived and were left in place.")
+    log_fs_timings(fs_stats)
+
+def read_archive_entries(json_path):
+    """Return [(rel_path, item)] for every entry of an archive, where item is either
+    (json_path, entry_start, entry_end) locating the raw entry bytes in the file, or the
+    entry re-serialized in compact form for archives not in the compact layout"""
+    json_path = Path(json_path)
+    if json_path.stat().st_size > 0:
+        with open(json_path, 'rb') as jf:
+            with mmap.mmap(jf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                spans = scan_archive(mm)
+        if spans is not None:
+            return [(normalize_path(json.loads(raw_path)), (json_path, start, end))
+                    for raw_path, _, (start, end) in spans]
+    with open(json_path, 'r', encoding='utf-8') as jf:
+        entries = json.load(jf)
+    return [(normalize_path(entry['r']),
+             json.dumps({'r': entry['r'], 'c': entry['c']}, separators=(',', ':')).encode('utf-8'))
+            for entry in entries]
+
+def write_repacked_archive(args):
+    """Write one repacked archive by copying encoded entries through unchanged"""
+    items, output_path = args
+    maps = {}
+    try:
+        with open(output_path, 'wb') as out:
+            out.write(b'[')
+            for n, item in enumerate(items):
+                if n:
+                    out.write(b',')
+                if isinstance(item, bytes):
+                    out.write(item)
+                    continue
+                source, start, end = item
+                if source not in maps:
+                    f = open(source, 'rb')
+                    maps[source] = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                with memoryview(maps[source][1])[start:end] as entry:
+                    out.write(entry)
+            out.write(b']')
+    finally:
+        for f, mm in maps.values():
+            mm.close()
+            f.close()
+    return output_path, len(items)
+
+def finish_repack(folder):
+    """Complete an interrupted or just-committed repack swap; safe to call repeatedly.
+    Returns False, leaving the journal in place, if a staged archive would replace one
+    written since the repack; the folder must then be sorted out by hand."""
+    folder = Path(folder)
+    journal = load_state(folder, REPACK_JOURNAL)
+    staging = folder / REPACK_STAGING
+    if not journal:
+        if staging.exists():
+            shutil.rmtree(staging, ignore_errors=True)  # Repack died before committing
+        return True
+    
+    old_names = set(journal['old'])
+    clashes = [name for name in journal['new'] if name not in old_names
+               and (staging / name).exists() and (folder / name).exists()]
+    if clashes:
+        logger.error(f"Cannot finish the interrupted repack of {folder}: {', '.join(clashes)}"
+                     f" were written since; move them aside and retry.")
+        return False
+    
+    new_names = set(journal['new'])
+    for name in journal['old']:
+        # An old name reused by the new set is only stale while its replacement is still staged
+        if (folder / name).exists() and (name not in new_names or (staging / name).exists()):
+            (folder / name).unlink()
+    for name in journal['new']:
+        if (staging / name).exists():
+            os.replace(staging / name, folder / name)
+    
+    save_state(folder, MANIFEST_FILE, journal['manifest'])
+    save_state(folder, TOMBSTONE_FILE, {})
+    shutil.rmtree(staging, ignore_errors=True)
+    save_state(folder, REPACK_JOURNAL, {})
+    return True
+
+def plan_repack_groups(sizes, target_size):
+    """Split entry sizes, kept in order, into the fewest groups no larger than target_size
+    (a single larger entry gets a group of its own), sized as evenly as possible.
+    Returns lists of entry indexes."""
+    def fill(cap):
+        # Greedy filling gives the fewest in-order groups none of which passes cap
+        groups, current, current_size = [], [], 0
+        for i, size in enumerate(sizes):
+            if current and current_size + size > cap:
+                groups.append(current)
+                current, current_size = [], 0
+            current.append(i)
+            current_size += size
+        groups.append(current)
+        return groups
+    
+    archive_count = len(fill(target_size))
+    # The lowest cap that needs no extra archive keeps the largest one as small as possible
+    low, high = 1, target_size
+    while low < high:
+        mid = (low + high) // 2
+        if len(fill(mid)) <= archive_count:
+            high = mid
+        else:
+            low = mid + 1
+    
+    # Within that cap, share the bytes still to place evenly between the archives still to fill
+    remaining = sum(sizes)
+    share = remaining / archive_count
+    groups, current, current_size = [], [], 0
+    for i, size in enumerate(sizes):
+        # Cut where the group lands closest to its share, or before it would pass the cap
+        if current and (current_size + size > low or current_size + size / 2 > share):
+            groups.append(current)
+            remaining -= current_size
+            share = remaining / max(1, archive_count - len(groups))
+            current, current_size = [], 0
+        current.append(i)
+        current_size += size
+    groups.append(current)
+    # Sharing can cut too early on awkward sizes; the plain fill at that cap always fits
+    return groups if len(groups) <= archive_count else fill(low)
+
+def repack_folder(folder_path, target_size=MAX_ARCHIVE_SIZE, progress_callback=None):
+    """Merge and rebalance a folder's archives into an evenly sized set near target_size.
+    Only live entries are kept and their encoded payloads are copied without recompressing.
+    The new set is built aside and swapped in through a journal, then recorded in a manifest."""
+    start_time = time.time()
+    
+    folder = Path(folder_path)
+    if not finish_repack(folder):
+        return
+    old_archives = list_archives(folder)
+    if not old_archives:
+        logger.info("No JSON archives found to repack.")
+        return
+    
+    # Collect the live entries in archive order; later copies of a path replace earlier ones
+    logger.info(f"Scanning {len(old_archives)} archive(s)...")
+    tombstones = load_tombstones(folder)
+    live = {}
+    for json_file in old_archives:
+        dead = tombstones.get(json_file.name, set())
+        for rel_path, item in read_archive_entries(json_file):
+            if rel_path not in dead:
+                live.pop(rel_path, None)
+                live[rel_path] = item
+    entries = list(live.values())
+    if not entries:
+        logger.info("No live entries to repack.")
+        return
+    
+    # Fewest archives under target_size, as evenly sized as the entry sizes allow
+    sizes = [len(item) if isinstance(item, bytes) else item[2] - item[1] for item in entries]
+    total_size = sum(sizes)
+    groups = [[entries[i] for i in group] for group in plan_repack_groups(sizes, target_size)]
+    
+    staging = folder / REPACK_STAGING
+    staging.mkdir()
+    logger.info(f"Repacking {len(entries)} entries ({total_size / (1024*1024):.1f} MB) into {len(groups)} archive(s)...")
+    if progress_callback:
+        progress_callback(0, len(groups))
+    
+    new_names = [f"archive_{i}.json" for i in range(1, len(groups) + 1)]
+    workers = min(len(groups), mp.cpu_count() * 2)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(write_repacked_archive, (group, staging / name))
+                       for group, name in zip(groups, new_names)]
+            for done, future in enumerate(futures, 1):
+                future.result()
+                if progress_callback:
+                    progress_callback(done, len(groups))
+        
+        # Verify the staged set before committing to it
+        for group, name in zip(groups, new_names):
+            if count_archive_entries(staging / name) != len(group):
+                raise ValueError(f"Entry count mismatch in repacked {name}")
+    except Exception as e:
+        logger.error(f"Repack failed, existing archives left untouched: {e}")
+        shutil.rmtree(staging, ignore_errors=True)
+        return
+    
+    manifest = {
+        'archives': [{'name': name, 'entries': len(group), 'size': (staging / name).stat().st_size}
+                     for group, name in zip(groups, new_names)],
+        'entries': len(entries),
+        'target_size': target_size,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    # Writing the journal is the commit point; finish_repack rolls forward from here
+    save_state(folder, REPACK_JOURNAL, {'old': [f.name for f in old_archives], 'new': new_names,
+                                        'manifest': manifest})
+    if not finish_repack(folder):
+        return
+    logger.info(f"Repacked {len(old_archives)} archive(s) into {len(new_names)} in {time.time() - start_time:.1f}s.")
+
+def repair_archive(json_path):
+    """Close an archive left open by an interrupted append: drop the partial trailing entry
+    and restore the closing bracket, or remove the file if no complete entry remains.
+    Returns True if the archive had to be repaired."""
+    json_path = Path(json_path)
+    with open(json_path, 'r+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # A trailing ']' proves nothing: paths are stored raw and may contain one
+                if scan_archive(mm) is not None:
+                    return False
+                if mm[:1] != b'[':
+                    raise ValueError(f"{json_path.name} is not an archive")
+                try:
+                    json.loads(mm[:])
+                    return False  # Complete, just not in the compact layout
+                except ValueError:
+                    pass
+                # Walk the complete entries; whatever follows the last one was cut off
+                end, pos = 1, 1
+                while True:
+                    match = ENTRY_PATTERN.match(mm, pos)
+                    if not match:
+                        break
+                    end = match.end()
+                    if mm[end:end + 1] != b',':
+                        break
+                    pos = end + 1
+            if end > 1:
+                f.truncate(end)
+                f.seek(end)
+                f.write(b']')
+                f.flush()
+                os.fsync(f.fileno())
+                return True
+    json_path.unlink()
+    return True
+
+def append_archive_entry(json_path, entry, known_size=None):
+    """Append one compact JSON entry to an archive, creating it if needed.
+    Only the closing bracket is replaced; existing entries are never rewritten.
+    known_size is the size returned by the previous append; unless the archive still has
+    exactly that size it is checked (and repaired) first. Returns the archive size afterwards."""
+    json_path = Path(json_path)
+    if json_path.exists() and json_path.stat().st_size != known_size:
+        repair_archive(json_path)  # An earlier append may have been interrupted
+    if not json_path.exists():
+        with open(json_path, 'wb') as f:
+            f.write(b'[' + entry + b']')
+            f.flush()
+            os.fsync(f.fileno())
+        return len(entry) + 2
+    with open(json_path, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b',' + entry + b']')
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+class InotifyWatcher:
+    """Report files written anywhere below a folder using Linux inotify"""
+    IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE = 0x2, 0x8, 0x80, 0x100
+    IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x4000, 0x8000, 0x40000000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    
+    def __init__(self, folder):
+        import ctypes
+        import ctypes.util
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folder = Path(folder)
+        self.dirs = {}
+        try:
+            self.add_tree(self.folder)
+        except OSError:
+            self.close()
+            raise
+    
+    def add_tree(self, root):
+        """Watch root and every directory below it; returns the files already there"""
+        found = []
+        for dirpath, _, filenames in os.walk(root):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), self.MASK)
+            if wd < 0:
+                err = self.ctypes.get_errno()
+                if err in (errno.ENOENT, errno.ENOTDIR):
+                    logger.debug(f"Not watching {dirpath}: removed before it could be watched")
+                    continue
+                if err == errno.EACCES:
+                    logger.warning(f"Not watching {dirpath}: permission denied")
+                    continue
+                raise OSError(err, f"inotify_add_watch failed for {dirpath}")
+            self.dirs[wd] = Path(dirpath)
+            found.extend(Path(dirpath) / name for name in filenames)
+        return found
+    
+    def changes(self, timeout):
+        """Wait up to timeout seconds and return the files touched since the last call"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        paths = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+                name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+                offset += 16 + length
+                if mask & self.IN_Q_OVERFLOW:
+                    paths.extend(self.add_tree(self.folder))  # Events were lost; rescan everything
+                    continue
+                if mask & self.IN_IGNORED:
+                    self.dirs.pop(wd, None)  # Directory was removed
+                    continue
+                parent = self.dirs.get(wd)
+                if parent is None or not name:
+                    continue
+                path = parent / os.fsdecode(name)
+                if mask & self.IN_ISDIR:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        paths.extend(self.add_tree(path))
+                else:
+                    paths.append(path)
+        return paths
+    
+    def rescan(self):
+        """Return every file below the folder, re-adding whatever watches can be added"""
+        try:
+            return self.add_tree(self.folder)
+        except OSError as e:
+            logger.warning(f"Could not re-add inotify watches: {e}")
+            return [f for f in self.folder.rglob('*') if f.is_file()]
+    
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """Fallback watcher that rescans the folder and reports files whose size/mtime changed"""
+    
+    def __init__(self, folder, interval=None):
+        self.folder = Path(folder)
+        self.interval = interval or WATCH_POLL_INTERVAL
+        self.snapshot = {}
+        self.next_scan = 0.0
+    
+    def changes(self, timeout):
+        """Wait up to timeout seconds and return the files changed since the last scan"""
+        delay = self.next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0.0, delay))
+        self.next_scan = time.monotonic() + self.interval
+        current = {}
+        for f in self.folder.rglob('*'):
+            try:
+                st = f.stat()
+            except FileNotFoundError:
+                continue
+            if not f.is_dir():
+                current[f] = (st.st_size, st.st_mtime_ns)
+        changed = [f for f, stamp in current.items() if self.snapshot.get(f) != stamp]
+        self.snapshot = current
+        return changed
+    
+    def rescan(self):
+        """Forget the last scan so the next one reports every file"""
+        self.snapshot = {}
+        self.next_scan = 0.0
+        return []
+    
+    def close(self):
+        pass
+
+def watch_folder(folder_path, debounce=WATCH_DEBOUNCE, cpu_limit=WATCH_CPU_LIMIT, io_limit=WATCH_IO_LIMIT,
+                 use_inotify=True, stop_event=None):
+    """Keep archiving new or changed files in a folder until interrupted (or stop_event is set).
+    Files are archived once they have been quiet for debounce seconds, compressed by a
+    throttled background thread and appended to a rolling archive_N.json; existing archives
+    are never rewritten. Originals are removed once stored, as zip_folder does."""
+    folder = Path(folder_path)
+    if not folder.is_dir():
+        logger.warning(f"{folder} is not a valid directory.")
+        return
+    if (folder / CHECKOUT_FILE).exists():
+        logger.warning(f"{folder} has checked-out files; run 'patch' before watching it.")
+        return
+    if not finish_repack(folder):
+        return
+    for archive in list_archives(folder):
+        if repair_archive(archive):
+            logger.warning(f"Repaired {archive.name} after an interrupted append.")
+    stop_event = stop_event or threading.Event()
+    
+    watcher = None
+    if use_inotify and sys.platform.startswith('linux'):
+        try:
+            watcher = InotifyWatcher(folder)
+            logger.info(f"Watching {folder} with inotify...")
+        except OSError as e:
+            logger.warning(f"inotify unavailable ({e}), falling back to polling.")
+    if watcher is None:
+        watcher = PollingWatcher(folder)
+        logger.info(f"Watching {folder} by polling every {watcher.interval:g}s...")
+    
+    def archivable(path):
+        rel_parts = path.relative_to(folder).parts
+        return (not str(path).lower().endswith('.json') and rel_parts[0] != REPACK_STAGING
+                and path.is_file())
+    
+    # Files waiting to go quiet, mapped to when they were last touched
+    pending = {}
+    pending_lock = threading.Lock()
+    work = queue.Queue()
+    
+    def compressor():
+        """Background thread: compress quiet files and append them to the rolling archive"""
+        buffer = io.BytesIO()
+        archive = archive_size = None
+        archived = 0
+        while True:
+            path = work.get()
+            if path is None:
+                break
+            try:
+                before = path.stat()
+                if time.time() - before.st_mtime < debounce:
+                    raise InterruptedError  # Written again since it was queued
+                wall_start, cpu_start = time.monotonic(), time.thread_time()
+                rel_path, encoded, _ = encode_file(path, folder, buffer)
+                after = path.stat()
+                if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+                    raise InterruptedError  # Changed while compressing
+                
+                entry = json.dumps({'r': rel_path, 'c': encoded}, separators=(',', ':')).encode('utf-8')
+                if archive is None or archive_size + len(entry) > MAX_ARCHIVE_SIZE:
+                    # Start a new archive instead of touching any that existed before
+                    next_index = next_archive_index(folder)
+                    archive, archive_size = folder / f"archive_{next_index}.json", None
+                archive_size = append_archive_entry(archive, entry, archive_size)
+                path.unlink()
+                archived += 1
+                logger.info(f"Archived {rel_path} -> {archive.name} ({archived} this session)")
+                
+                # Throttle: keep CPU use under cpu_limit and I/O under io_limit
+                wall = time.monotonic() - wall_start
+                cpu = time.thread_time() - cpu_start
+                delay = max(cpu / cpu_limit, (after.st_size + len(entry)) / io_limit) - wall
+                if delay > 0:
+                    stop_event.wait(delay)
+            except FileNotFoundError:
+                pass  # Removed before we got to it
+            except InterruptedError:
+                with pending_lock:
+                    pending[path] = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error archiving {path}: {e}")
+    
+    worker = threading.Thread(target=compressor, name='watch-compressor')
+    worker.start()
+    
+    # Anything already sitting in the folder is picked up as well
+    now = time.monotonic()
+    for f in folder.rglob('*'):
+        if f.is_file() and archivable(f):
+            pending[f] = now
+    
+    try:
+        while not stop_event.is_set():
+            try:
+                touched = watcher.changes(min(1.0, debounce))
+            except OSError as e:
+                # Events from this batch may be lost; keep watching from a full rescan
+                logger.warning(f"Watch error ({e}), rescanning {folder}.")
+                touched = watcher.rescan()
+            now = time.monotonic()
+            with pending_lock:
+                for path in touched:
+                    if path.exists() and archivable(path):
+                        pending[path] = now
+                due = [path for path, last in pending.items() if now - last >= debounce]
+                for path in due:
+                    del pending[path]
+            for path in due:
+                work.put(path)
+    except KeyboardInterrupt:
+        logger.info("Stopping watch...")
+    finally:
+        stop_event.set()
+        work.put(None)
+        worker.join()
+        watcher.close()
+    if pending:
+        logger.warning(f"{len(pending)} file(s) were still settling and will be picked up next time.")
 
 def main():
+    autotune = '--autotune' in sys.argv
+    if autotune:
+        sys.argv.remove('--autotune')
+    poll = '--poll' in sys.argv
+    if poll:
+        sys.argv.remove('--poll')
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if '--log-file' in sys.argv:
+        index = sys.argv.index('--log-file')
+        if index + 1 >= len(sys.argv):
+            print("--log-file needs a path")
+            return
+        log_file = sys.argv[index + 1]
+        del sys.argv[index:index + 2]
+        handler = logging.FileHandler(log_file, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
+        logging.getLogger().addHandler(handler)
     if len(sys.argv) < 3:
-        print("Usage: python zipper.py <zip|unzip> <folder_path> [output_dir_for_zip]")
+        print("Usage: python zipper.py <zip|unzip|patch> <folder_path> [output_dir_for_zip] [--autotune]")
+        print("       python zipper.py checkout <folder_path> <path> [path ...]")
+        print("       python zipper.py repack <folder_path> [target_size_mb]")
+        print("       python zipper.py watch <folder_path> [--poll]")
+        print("       Any operation also accepts --log-file <path>")
         return
     operation = sys.argv[1].lower()
     folder_path = sys.argv[2]
     output_dir = sys.argv[3] if len(sys.argv) > 3 else None
     if operation == 'zip':
         if output_dir:
-            zip_folder([folder_path, output_dir])
+            zip_folder([folder_path, output_dir], autotune=autotune)
         else:
-            zip_folder(folder_path)
+            zip_folder(folder_path, autotune=autotune)
     elif operation == 'unzip':
         unzip_folder(folder_path)
+    elif operation == 'checkout':
+        checkout_paths(folder_path, sys.argv[3:])
+    elif operation == 'patch':
+        patch_folder(folder_path)
+    elif operation == 'repack':
+        if output_dir:
+            try:
+                target_size = int(float(output_dir) * 1024 * 1024)
+            except ValueError:
+                target_size = 0
+            if target_size <= 0:
+                print("target_size_mb must be a number greater than 0")
+                return
+            repack_folder(folder_path, target_size)
+        else:
+            repack_folder(folder_path)
+    elif operation == 'watch':
+        watch_folder(folder_path, use_inotify=not poll)
     else:
-        print("Invalid operation. Use 'zip' or 'unzip'.")
+        print("Invalid operation. Use 'zip', 'unzip', 'checkout', 'patch', 'repack' or 'watch'.")
 
 if __name__ == "__main__":
     main()